@@ -1,20 +1,22 @@
 import asyncio
 import logging
+import secrets
 import uuid
 from asyncio import gather
-from collections import defaultdict
-from copy import deepcopy
+from collections import defaultdict, deque
 from datetime import datetime, timedelta
-from typing import List, Optional, Set
+from itertools import islice
+from typing import List, Optional, Set, Tuple
 
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.conf import settings
+from django.db import transaction
 from django.utils.dateparse import parse_datetime
 from django.utils.timezone import now
 from faker import Faker
 
-from draw.utils import Chain, dump_content, user_id_for_room
+from draw.utils import Chain, JSONType, dump_content, user_id_for_room
 from draw.utils.auth import user_is_authenticated, user_is_authorized, user_is_staff
 from draw.utils.django_loaded import LoggingAsyncJsonWebsocketConsumer
 
@@ -22,15 +24,106 @@ from . import models as m
 
 logger = logging.getLogger("draw.collab")
 
+# log records of element changes of all rooms are buffered per process and written in batches.
+# the buffer is flushed ``RECORD_FLUSH_INTERVAL`` after the first record has been added to it or
+# as soon as it contains ``RECORD_FLUSH_BATCH_SIZE`` records.
+RECORD_FLUSH_INTERVAL = timedelta(seconds=1)
+RECORD_FLUSH_BATCH_SIZE = 500
+
 create_record = database_sync_to_async(m.ExcalidrawLogRecord.objects.create)
-bulk_create_records = database_sync_to_async(m.ExcalidrawLogRecord.objects.bulk_create)
-upsert_room = database_sync_to_async(m.ExcalidrawRoom.objects.update_or_create)
-get_or_create_room = database_sync_to_async(m.ExcalidrawRoom.objects.get_or_create)
 auth_room = database_sync_to_async(
     m.ExcalidrawRoom.objects.only("room_name", "tracking_enabled").get_or_create)
 stored_pseudonym_for_user_in_room = database_sync_to_async(
     m.Pseudonym.stored_pseudonym_for_user_in_room)
 
+def insert_records(records_with_content: List[Tuple[m.ExcalidrawLogRecord, JSONType]]):
+    """
+    Sets the content of the records and inserts them.
+
+    The content is only serialized here, in the thread pool,
+    so the encoding does not block the event loop.
+    """
+    records = []
+    for record, content in records_with_content:
+        record.content = content
+        records.append(record)
+    # one transaction for all insert statements, however many batches they are split into
+    with transaction.atomic():
+        return m.ExcalidrawLogRecord.objects.bulk_create(records, batch_size=RECORD_FLUSH_BATCH_SIZE)
+
+bulk_create_records = database_sync_to_async(insert_records)
+
+@database_sync_to_async
+def create_change_records(
+    room_name: str, event_type: str, user_pseudonym: str,
+    timed_changes: List[Tuple[datetime, dict]]
+):
+    """
+    Creates the log records for ``(created_at, content)`` pairs. The model
+    instances are built in the thread pool as well, not on the event loop.
+    """
+    return insert_records([
+        (m.ExcalidrawLogRecord(
+            room_name=room_name,
+            event_type=event_type,
+            user_pseudonym=user_pseudonym,
+            created_at=created_at), change)
+        for created_at, change in timed_changes])
+
+class LogRecordBuffer:
+    """
+    Collects log records of all consumers in this process and inserts them in batches.
+
+    No timer runs while the buffer is empty. Adding the first record schedules
+    a flush after ``interval``. A full buffer is flushed immediately.
+    """
+    def __init__(self, interval: timedelta, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.records: List[Tuple[m.ExcalidrawLogRecord, JSONType]] = []
+        self.flush_task: Optional[asyncio.Task] = None
+        # strong references to running tasks, see ``CollaborationConsumer.create_task``
+        self._tasks: Set[asyncio.Task] = set()
+
+    def create_task(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def add(self, record: m.ExcalidrawLogRecord, content: JSONType):
+        """
+        Adds a log record and its content to the buffer.
+        """
+        self.records.append((record, content))
+        if len(self.records) >= self.batch_size:
+            self.create_task(self.flush())
+        elif self.flush_task is None:
+            self.flush_task = self.create_task(self.flush_later())
+
+    async def flush_later(self):
+        try:
+            await asyncio.sleep(self.interval.total_seconds())
+        finally:
+            # also reset if cancelled, otherwise no later add() would schedule a flush again
+            self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """
+        Inserts all buffered records. Errors are logged, so a failing insert
+        only loses its own batch and does not go unnoticed.
+        """
+        if not self.records:
+            return
+        batch, self.records = self.records, []
+        try:
+            await bulk_create_records(batch)
+        except Exception: # pylint: disable=broad-except
+            logger.exception("could not store %d log records", len(batch))
+
+record_buffer = LogRecordBuffer(RECORD_FLUSH_INTERVAL, RECORD_FLUSH_BATCH_SIZE)
+
 @database_sync_to_async
 def get_known_file_ids(room_name: str):
     return {
@@ -39,15 +132,63 @@ def get_known_file_ids(room_name: str):
             .filter(belongs_to=room_name)\
             .values_list('element_file_id')}
 
+def update_room_elements(room_name: str, elements: List[dict]) -> bool:
+    """
+    Stores the elements of a room if all of them have a newer or equal version than
+    the stored ones and at least one of them is newer.
+
+    The room row is locked while the versions are compared, so no concurrent save can
+    slip in between reading and writing the elements.
+
+    :returns: whether the elements have been stored.
+    """
+    rooms = m.ExcalidrawRoom.objects.select_for_update().only('_elements')
+    with transaction.atomic():
+        room = rooms.filter(room_name=room_name).first()
+        if room is None:
+            elements_to_store, _ = dump_content(elements, force_compression=True)
+            _, created = m.ExcalidrawRoom.objects.get_or_create(
+                room_name=room_name, defaults={'_elements': elements_to_store})
+            if created:
+                return True
+            # another save created the room in the meantime. compare against its elements.
+            room = rooms.get(room_name=room_name)
+
+        old_versions = {e['id']: e['version'] for e in room.elements}
+        differences_detected = False
+        for e in elements:
+            old_version = old_versions.get(e['id'], -1)
+            new_version = e['version']
+            if old_version > new_version:
+                # stop when an old version is newer. the reconciliation algo for merging the
+                # elements is executed on the client side. clients should send a new save_room
+                # event after merging the state, updating all elements to their newset versions.
+                # deleted items have to be stored so the reconciliation algo can detect them
+                # and delete them on the client side. if the server would delete them here,
+                # the client would not know that the element was deleted and would not be able
+                # to delete it on the client side.
+                return False
+            if new_version > old_version:
+                differences_detected = True
+
+        if not differences_detected:
+            return False
+
+        room._elements, _ = dump_content(elements, force_compression=True)
+        room.save(update_fields=['_elements', 'last_update'])
+    return True
+
+store_room_elements = database_sync_to_async(update_room_elements)
+
 @database_sync_to_async
 def user_name(user):
     return user.username
 
 
 class CollaborationConsumer(LoggingAsyncJsonWebsocketConsumer):
-    allowed_eventtypes = {
+    allowed_eventtypes = frozenset({
         'collaborator_change', 'elements_changed',
-        'save_room', 'full_sync', 'files_added'}
+        'save_room', 'full_sync', 'files_added'})
     channel_layer_namespace = 'draw_room_'
 
     def create_task(self, coro, *, name=None):
@@ -74,12 +215,12 @@ class CollaborationConsumer(LoggingAsyncJsonWebsocketConsumer):
         self.kwargs = self.scope['url_route']['kwargs']
         self.user: m.CustomUser = self.scope['user']
         self.room_name = self.kwargs['room_name']
-        room, _ = await auth_room(room_name=self.room_name)
+        # the authentication check does not need the room, so it runs while the room is fetched
+        (room, _), authenticated = await gather(
+            auth_room(room_name=self.room_name),
+            user_is_authenticated(self.user))
         self.tracking_enabled = room.tracking_enabled
-
-        authenticated, authorized = await gather(
-            user_is_authenticated(self.user),
-            user_is_authorized(self.user, room, self.scope.get("session")))
+        authorized = await user_is_authorized(self.user, room, self.scope.get("session"))
         if (not settings.ALLOW_ANONYMOUS_VISITS
             and self.room_name not in settings.PUBLIC_ROOMS
             and not authenticated
@@ -100,9 +241,12 @@ class CollaborationConsumer(LoggingAsyncJsonWebsocketConsumer):
             await self.send_json({'eventtype': 'login_required'})
             return await self.disconnect(3000)
 
-        self.user_room_id = (await stored_pseudonym_for_user_in_room(self.user, room)) \
-            if self.user.id is not None \
-            else user_id_for_room(uuid.uuid4(), self.room_name)
+        if self.user.id is not None:
+            # the pseudonym is derived from the ids, storing it can happen in the background
+            self.user_room_id = user_id_for_room(self.user.pk, room.room_name)
+            self.create_task(stored_pseudonym_for_user_in_room(self.user, room))
+        else:
+            self.user_room_id = user_id_for_room(secrets.token_bytes(16), self.room_name)
 
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         connect = await super().connect()
@@ -140,6 +284,8 @@ class CollaborationConsumer(LoggingAsyncJsonWebsocketConsumer):
                     user_pseudonym=self.user_room_id,
                     _content=b'null',
                     _compressed=False))
+        # don't leave the buffered changes behind if the server shuts down
+        await record_buffer.flush()
         return disconnect
 
     async def notify_collaborators_about_leaving(self):
@@ -157,37 +303,30 @@ class CollaborationConsumer(LoggingAsyncJsonWebsocketConsumer):
         Forwards all updates to users and their pointers to clients and logs them to the data base.
         """
         # logger.debug("called collaborator_change")
-        collaborator_to_send = deepcopy(changes[-1])
+        # a shallow copy suffices, the loop below only removes top level keys of the changes
+        collaborator_to_send = {**changes[-1], 'userRoomId': self.user_room_id}
 
         if self.tracking_enabled:
             # the reference datetime is calculated on the server so that we
             # don't have to rely on the client to send the correct datetime.
             # only the time delta of the client actions need to be correct.
-            client_reference_dt = collaborator_to_send.get('time', None)
-            client_reference_dt = parse_datetime(client_reference_dt) if client_reference_dt else now()
             now_dt = now()
+            client_reference_dt = collaborator_to_send.get('time', None)
+            client_reference_dt = parse_datetime(client_reference_dt) if client_reference_dt else now_dt
 
-            records = []
+            timed_changes = []
 
             for change in changes:
                 del change['username']
 
                 # time recalculation happens here.
                 client_dt = change.pop('time', None)
-                client_dt = parse_datetime(client_dt) if client_dt else now()
-                delta = client_reference_dt - client_dt
-
-                record = m.ExcalidrawLogRecord(
-                    room_name=room_name,
-                    event_type=eventtype,
-                    user_pseudonym=self.user_room_id,
-                    created_at=now_dt - delta)
-                record.content = change
-                records.append(record)
+                client_dt = parse_datetime(client_dt) if client_dt else now_dt
+                timed_changes.append((now_dt - (client_reference_dt - client_dt), change))
 
-            self.create_task(bulk_create_records(records))
+            self.create_task(create_change_records(
+                room_name, eventtype, self.user_room_id, timed_changes))
 
-        collaborator_to_send['userRoomId'] = self.user_room_id
         self.create_task(self.send_event(eventtype, changes=[collaborator_to_send]))
 
     async def full_sync(self, room_name, eventtype, elements, **kwargs):
@@ -204,14 +343,11 @@ class CollaborationConsumer(LoggingAsyncJsonWebsocketConsumer):
             record = m.ExcalidrawLogRecord(
                 room_name=room_name,
                 event_type=eventtype,
-                user_pseudonym=self.user_room_id
+                user_pseudonym=self.user_room_id,
+                created_at=now()
             )
-            record.content = elements
-            await gather(
-                self.send_event(eventtype, elements=elements, **kwargs),
-                database_sync_to_async(record.save)())
-        else:
-            await self.send_event(eventtype, elements=elements, **kwargs)
+            record_buffer.add(record, elements)
+        await self.send_event(eventtype, elements=elements, **kwargs)
 
     async def files_added(self, room_name, eventtype, fileids: List[str], **kwargs):
         """
@@ -238,44 +374,20 @@ class CollaborationConsumer(LoggingAsyncJsonWebsocketConsumer):
         Saves the room if all submitted elements have a newer or equal version than the saved version.
 
         If a submitted element happens to have an older version number than an already stored
-        version of the element, nothing will be done. It is assumed, taht the clients submit
-        storage requests often enogh so that not too much data will be lost if this happens.
+        version of the element, nothing will be done. The stored room is locked during the
+        comparison, so concurrent saves can't overwrite each other's newer versions. It is
+        assumed, that the clients submit storage requests often enough so that not too much
+        data will be lost if a save is rejected.
         This is because the author wants the element reconciliation always to be executed on
         the client side and not both, the client and the server. The clients should instead
         ensure that a ``full_sync`` happens often enough.
 
         Deleted elements will not be saved.
         """
-        old_room, created = await get_or_create_room(room_name=room_name)
-        old_versions = {e['id']: e['version'] for e in old_room.elements}
-
-        differences_detected = False
-
-        if not created:
-            for e in elements:
-                old_version = old_versions.get(e['id'], -1)
-                if old_version > e['version']:
-                    # stop when an old version is newer. the reconciliation algo for merging the
-                    # elements is executed on the client side. clients should send a new save_room
-                    # event after merging the state, updating all elements to their newset versions.
-                    # deleted items have to be stored so the reconciliation algo can detect them
-                    # and delete them on the client side. if the server would delete them here,
-                    # the client would not know that the element was deleted and would not be able
-                    # to delete it on the client side.
-                    return
-                differences_detected = differences_detected or old_version < e['version']
-        else:
-            differences_detected = True
-
-        if differences_detected:
+        if await store_room_elements(room_name, elements):
             known_file_ids = set(e['fileId'] for e in elements if 'fileId' in e)
-
-            elements_to_store, _ = dump_content(elements, force_compression=True)
-            room_tuple, _ = await gather(
-                upsert_room(room_name=room_name, defaults={'_elements': elements_to_store}),
-                self.maybe_request_missing_files(room_name, known_file_ids))
-            room, _ = room_tuple
-            logger.debug("room %s saved", room.room_name)
+            self.create_task(self.maybe_request_missing_files(room_name, known_file_ids))
+            logger.debug("room %s saved", room_name)
     # endregion user actions
 
     # region channel layer handling
@@ -307,7 +419,14 @@ class CollaborationConsumer(LoggingAsyncJsonWebsocketConsumer):
     # endregion channel layer handling
 
 
-get_log_record = database_sync_to_async(m.ExcalidrawLogRecord.objects.get)
+@database_sync_to_async
+def get_log_records(ids: List[int]) -> List[Optional[m.ExcalidrawLogRecord]]:
+    """
+    Returns the records in the order of ``ids``, ``None`` for records that
+    have been deleted since their ids were read.
+    """
+    records = m.ExcalidrawLogRecord.objects.in_bulk(ids)
+    return [records.get(pk) for pk in ids]
 
 @database_sync_to_async
 def get_log_record_info_for_room(room_name):
@@ -318,13 +437,19 @@ def get_log_record_info_for_room(room_name):
 
 MAX_WAIT_TIME = timedelta(milliseconds=settings.BROADCAST_RESOLUTION_THROTTLE_MSEC)
 
+# records are fetched in chunks ahead of the replay. the next chunk is
+# requested as soon as less than the watermark is left in the buffer.
+REPLAY_CHUNK_SIZE = 500
+REPLAY_PREFETCH_WATERMARK = 100
+
 
 class ReplayConsumer(AsyncJsonWebsocketConsumer):
-    allowed_eventtypes = {'start_replay', 'pause_replay', 'restart_replay'}
+    allowed_eventtypes = frozenset({'start_replay', 'pause_replay', 'restart_replay'})
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._tasks: set[asyncio.Task] = set()
+        self.prefetch_task: Optional[asyncio.Task] = None
 
     def create_task(self, coro, *, name=None):
         task = asyncio.create_task(coro, name=name)
@@ -390,11 +515,18 @@ class ReplayConsumer(AsyncJsonWebsocketConsumer):
         """
         Inicjalizuje replay, obliczając całkowity czas trwania na podstawie logów.
         """
-        self.log_record_info = await get_log_record_info_for_room(room_name=self.room_name)
+        # a deque, since the replay consumes the records from the left
+        self.log_record_info = deque(await get_log_record_info_for_room(room_name=self.room_name))
+        self.log_record_ids = [log_id for log_id, _ in self.log_record_info]
+        self.fetch_position = 0
+        self.prefetched_records = deque()
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+            self.prefetch_task = None
 
         prev_record_time = self.log_record_info[0][1]
         delta = timedelta(0)
-        for _, curr_record_time in self.log_record_info[1:]:
+        for _, curr_record_time in islice(self.log_record_info, 1, None):
             delta += min(MAX_WAIT_TIME, curr_record_time - prev_record_time)
             prev_record_time = curr_record_time
         duration = int(delta.total_seconds() * 1000)
@@ -410,7 +542,7 @@ class ReplayConsumer(AsyncJsonWebsocketConsumer):
         logger.info('Start replay mode for room %s', self.room_name)
         if not getattr(self, 'log_record_info', []):
             await self.init_replay()
-        self.replay_task = self.create_task(self.send_then_wait())
+        self.replay_task = self.create_task(self.replay_loop())
         await self.send_json({'eventtype': 'start_replay'})
 
     async def pause_replay(self, *args, **kwargs):
@@ -424,9 +556,38 @@ class ReplayConsumer(AsyncJsonWebsocketConsumer):
         await self.init_replay()
         await self.start_replay()
 
+    async def fetch_next_records(self):
+        """
+        Loads the next chunk of log records into the prefetched records.
+        The position only advances once the chunk has been fetched, so a
+        failed fetch is repeated by the next one.
+        """
+        prefetched_records = self.prefetched_records
+        ids = self.log_record_ids[self.fetch_position:self.fetch_position + REPLAY_CHUNK_SIZE]
+        records = await get_log_records(ids)
+        self.fetch_position += len(ids)
+        prefetched_records.extend(records)
+
+    def prefetch_records(self) -> asyncio.Task:
+        """
+        Starts fetching the next chunk unless a fetch is already running.
+        """
+        if self.prefetch_task is None or self.prefetch_task.done():
+            self.prefetch_task = self.create_task(self.fetch_next_records())
+        return self.prefetch_task
+
     async def send_next_event(self):
-        log_id, _ = self.log_record_info.pop(0)
-        record: m.ExcalidrawLogRecord = await get_log_record(pk=log_id)
+        log_id, _ = self.log_record_info.popleft()
+        if not self.prefetched_records:
+            await self.prefetch_records()
+        record: Optional[m.ExcalidrawLogRecord] = self.prefetched_records.popleft()
+        if (len(self.prefetched_records) < REPLAY_PREFETCH_WATERMARK
+            and self.fetch_position < len(self.log_record_ids)):
+            self.prefetch_records()
+        if record is None:
+            # deleted since the replay was initialized
+            return
+        assert record.pk == log_id
         if record.event_type in ['full_sync', 'elements_changed']:
             await self.send_json({
                 'eventtype': record.event_type,
@@ -442,8 +603,11 @@ class ReplayConsumer(AsyncJsonWebsocketConsumer):
                 }]
             })
 
-    async def send_then_wait(self):
-        if self.log_record_info:
+    async def replay_loop(self):
+        """
+        Sends the log records one after another until the replay has finished.
+        """
+        while self.log_record_info:
             # Jeśli mamy co najmniej dwa wpisy, obliczamy czas oczekiwania
             if len(self.log_record_info) >= 2:
                 current_timestamp = self.log_record_info[0][1]
@@ -456,7 +620,6 @@ class ReplayConsumer(AsyncJsonWebsocketConsumer):
             async with self.message_was_sent_condition:
                 await self.send_next_event()
             await asyncio.sleep(sleep_time.total_seconds())
-            self.replay_task = self.create_task(self.send_then_wait())
-        else:
-            async with self.message_was_sent_condition:
-                await self.send_json({'eventtype': 'pause_replay'})
+
+        async with self.message_was_sent_condition:
+            await self.send_json({'eventtype': 'pause_replay'})
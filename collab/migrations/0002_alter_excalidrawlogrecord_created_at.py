@@ -0,0 +1,19 @@
+# Generated by Django 4.2.19 on 2026-10-15 09:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collab', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='excalidrawlogrecord',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -14,6 +14,7 @@ from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.core.validators import MinLengthValidator, MaxLengthValidator
 from django.db import models
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
 from draw.utils import (JSONType, bytes_to_data_uri, compression_ratio, dump_content, load_content, make_room_name,
@@ -56,7 +57,8 @@ class ExcalidrawLogRecord(models.Model):
     """
     # dates are sorted after field size. this reduces table size in postgres.
     _compressed = models.BooleanField(editable=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # not ``auto_now_add`` as records may be written in batches some time after the event happened
+    created_at = models.DateTimeField(default=now)
     room_name = models.UUIDField()
     event_type = models.CharField(max_length=50)
     # if a user is deleted, keep the foreign key to be able to keep the action log
@@ -123,7 +125,7 @@ class ExcalidrawRoom(models.Model):
 
     @elements.setter
     def elements(self, val: JSONType = None):
-        self._elements = dump_content(val, force_compression=True)
+        self._elements, _ = dump_content(val, force_compression=True)
 
     @cached_property
     def compressed_size(self):
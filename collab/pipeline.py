@@ -1,7 +1,26 @@
+import atexit
+
 import requests
 from django.contrib import messages
 from django.core.files.base import ContentFile
 from django.utils.timezone import now
+from requests.adapters import HTTPAdapter
+
+# the adapter's urllib3 pool manager is thread safe and keeps the connections to the picture
+# hosts alive. sessions are created per call, so no cookies are shared between users.
+_http_adapter = HTTPAdapter()
+atexit.register(_http_adapter.close)
+
+def http_session() -> requests.Session:
+    """
+    A fresh session that sends its requests over the shared connection pool.
+
+    Don't close the session, that would close the shared adapter, too.
+    """
+    session = requests.Session()
+    session.mount('http://', _http_adapter)
+    session.mount('https://', _http_adapter)
+    return session
 
 def update_profile_picture(backend, user, response, *args, **kwargs):
     """
@@ -18,7 +37,7 @@ def update_profile_picture(backend, user, response, *args, **kwargs):
         return
 
     try:
-        r = requests.get(picture_url, timeout=5)
+        r = http_session().get(picture_url, timeout=5)
         if r.status_code == 200:
             # Create a unique filename for the profile picture, e.g. "profile_<user.pk>_<timestamp>.jpg"
             file_name = f"profile_{user.pk}_{now().strftime('%Y%m%d%H%M%S')}.jpg"
@@ -1,3 +1,77 @@
-from django.test import TestCase
+import uuid
 
-# Create your tests here.
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from draw.utils import user_id_for_room
+
+from . import models as m
+from .consumers import CollaborationConsumer, update_room_elements
+
+
+def element(element_id: str, version: int):
+    return {'id': element_id, 'version': version, 'type': 'rectangle'}
+
+
+class UpdateRoomElementsTest(TestCase):
+    def setUp(self):
+        self.room = m.ExcalidrawRoom.objects.create(user_room_name='test room')
+        self.room.elements = [element('a', 2), element('b', 1)]
+        self.room.save()
+
+    def stored_elements(self, room_name=None):
+        return m.ExcalidrawRoom.objects.get(room_name=room_name or self.room.room_name).elements
+
+    def test_newer_version_is_stored(self):
+        elements = [element('a', 3), element('b', 1)]
+        self.assertTrue(update_room_elements(self.room.room_name, elements))
+        self.assertEqual(self.stored_elements(), elements)
+
+    def test_older_version_is_rejected(self):
+        elements = [element('a', 1), element('b', 2)]
+        self.assertFalse(update_room_elements(self.room.room_name, elements))
+        self.assertEqual(self.stored_elements(), [element('a', 2), element('b', 1)])
+
+    def test_unchanged_versions_are_skipped(self):
+        last_update = m.ExcalidrawRoom.objects.get(room_name=self.room.room_name).last_update
+        elements = [element('a', 2), element('b', 1)]
+        self.assertFalse(update_room_elements(self.room.room_name, elements))
+        self.assertEqual(
+            m.ExcalidrawRoom.objects.get(room_name=self.room.room_name).last_update, last_update)
+
+    def test_missing_room_is_created(self):
+        room_name = uuid.uuid4()
+        elements = [element('c', 1)]
+        self.assertTrue(update_room_elements(room_name, elements))
+        self.assertEqual(self.stored_elements(room_name), elements)
+
+
+class UserIdForRoomTest(TestCase):
+    def test_uuid_str_and_bytes_give_the_same_id(self):
+        uid, room_name = uuid.uuid4(), uuid.uuid4()
+        expected = user_id_for_room(uid, room_name)
+        self.assertEqual(user_id_for_room(uid.bytes, room_name), expected)
+        self.assertEqual(user_id_for_room(uid, str(room_name)), expected)
+        self.assertEqual(user_id_for_room(uid.bytes, str(room_name)), expected)
+
+
+@override_settings(
+    ALLOW_ANONYMOUS_VISITS=True,
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class AnonymousConnectTest(TransactionTestCase):
+    async def test_anonymous_user_can_connect(self):
+        # the url router passes the room name as string
+        room_name = str(uuid.uuid4())
+        communicator = WebsocketCommunicator(
+            CollaborationConsumer.as_asgi(), f'/ws/collab/{room_name}/collaborate')
+        communicator.scope.update({
+            'url_route': {'kwargs': {'room_name': room_name}},
+            'user': AnonymousUser(),
+            'session': {},
+        })
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        # a failed check would answer with a login_required event
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
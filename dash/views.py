@@ -7,6 +7,7 @@ from django.db.models import Q, Count
 from django.http import JsonResponse
 from django.urls import reverse
 from django.utils.decorators import method_decorator
+from django.utils.timezone import now
 from django.utils.translation import gettext as _
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
@@ -100,14 +101,15 @@ class MyBoardView(View):
             messages.error(request, _("Nie podano nazwy tablicy."))
             return redirect('my')
 
-        try:
-            room = ExcalidrawRoom.objects.get(room_name=room_name, room_created_by=request.user)
-        except ExcalidrawRoom.DoesNotExist:
+        # a single UPDATE instead of fetching and saving the whole room including its elements.
+        # update() skips auto_now, so last_update has to be set explicitly.
+        updated = ExcalidrawRoom.objects \
+            .filter(room_name=room_name, room_created_by=request.user) \
+            .update(user_room_name=new_room_name, last_update=now())
+        if not updated:
             messages.error(request, _("Nie znaleziono tablicy o podanej nazwie."))
             return redirect('my')
 
-        room.user_room_name = new_room_name
-        room.save()
         messages.success(request, _("Pomyślnie zmieniono nazwę tablicy!"))
         return redirect('my')
 
@@ -196,17 +198,13 @@ class MyBoardGroup(View):
             messages.error(request, 35, _("Nie podano wszystkich danych."), 'danger')
             return redirect('my_board_groups')
 
-        try:
-            group = BoardGroups.objects.get(group_id=group_id, owner=request.user)
-        except BoardGroups.DoesNotExist:
+        updated = BoardGroups.objects \
+            .filter(group_id=group_id, owner=request.user) \
+            .update(class_name=new_class_name, class_year=new_class_year, category=new_category)
+        if not updated:
             messages.add_message(request, 35, _("Nie znaleziono grupy o podanym ID."), 'danger')
             return redirect('my_board_groups')
 
-        group.class_name = new_class_name
-        group.class_year = new_class_year
-        group.category = new_category
-        group.save()
-
         messages.success(request, _("Pomyślnie zmieniono dane grupy!"))
         return redirect('my_board_groups')
 
@@ -2,7 +2,6 @@
 Helper functions and classes that don't need any configured state or django stuff loaded.
 """
 import base64
-import json
 import logging
 import random
 import re
@@ -15,6 +14,7 @@ from pprint import pformat
 from typing import (Any, Callable, Collection, Dict, Generic, Hashable, Iterable, List, Optional, Protocol, Sequence,
                     Tuple, TypeVar, Union, cast)
 
+import orjson
 from asgiref.sync import sync_to_async
 from django.core.exceptions import ValidationError
 from django.http import HttpRequest
@@ -195,11 +195,11 @@ JSONType = Optional[Union[dict, list, str, int, float]]
 def load_content(content: Union[bytes, bytearray, memoryview], compressed: bool = True) -> JSONType:
     content = bytes(content)
     if compressed:
-        return json.loads(zlib.decompress(content).decode('utf-8'))
-    return json.loads(content.decode('utf-8'))
+        return orjson.loads(zlib.decompress(content))
+    return orjson.loads(content)
 
 def dump_content(content: JSONType, force_compression=False) -> Tuple[bytes, bool]:
-    val_bytes = json.dumps(content, ensure_ascii=False).encode('utf-8')
+    val_bytes = orjson.dumps(content)
     compressed = zlib.compress(val_bytes)
     if force_compression or len(compressed) < len(val_bytes):
         return compressed, True
@@ -214,13 +214,23 @@ def compression_ratio(obj: HasCompressionInformation):
     return f"{comp:.2f} %"
 
 def uncompressed_json_size(uncompressed_content: JSONType):
-    return len(json.dumps(uncompressed_content, ensure_ascii=False).encode('utf-8'))
+    return len(orjson.dumps(uncompressed_content))
 
 def flatten_list(l: list):
     return [flatten_list(e) if isinstance(e, list) else e for e in l]
 
-def user_id_for_room(uid: uuid.UUID, room_name: uuid.UUID):
-    return sha256(uid.bytes + b":" + room_name.bytes).hexdigest()
+def uuid_bytes(value: Union[uuid.UUID, str, bytes]) -> bytes:
+    """
+    :returns: the 16 bytes of a UUID given as ``UUID``, as string or as raw bytes.
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return uuid.UUID(value).bytes
+    return value.bytes
+
+def user_id_for_room(uid: Union[uuid.UUID, bytes], room_name: Union[uuid.UUID, str]):
+    return sha256(uuid_bytes(uid) + b":" + uuid_bytes(room_name)).hexdigest()
 
 def make_room_name(length):
     return "".join(random.choices(string.ascii_letters + string.digits, k=length))
@@ -11,7 +11,6 @@ from django.utils.translation import gettext_lazy as _
 from django.contrib import messages
 
 from collab.models import BoardGroups, ExcalidrawRoom
-from draw.utils import async_get_object_or_404
 
 User = Union[AbstractBaseUser, AnonymousUser]
 
@@ -116,13 +115,32 @@ async def user_is_staff_view(request):
     return HttpResponse('', status=200)
 
 
-@sync_to_async
 def user_in_board_group(room_obj, user):
     return BoardGroups.objects.filter(boards=room_obj, users=user).exists()
 
-@sync_to_async
 def check_is_owner(room_obj, user):
-    return room_obj.room_created_by == user
+    # compare the ids, so the creator does not have to be fetched from the db
+    return room_obj.room_created_by_id == user.pk
+
+@sync_to_async
+def group_member_check(request, room_name):
+    """
+    Runs the checks of :func:`group_and_login_required` in a single thread pool call.
+
+    :returns: a response if the user may not access the room, otherwise ``None``.
+    """
+    # Sprawdź, czy użytkownik jest zalogowany
+    if not request.user.is_authenticated:
+        messages.add_message(request, 30, _("Użytkownik musi być zalogowany!"), 'danger')
+        return redirect('custom_login')
+
+    room_obj = get_object_or_404(ExcalidrawRoom.objects.only('room_created_by'), room_name=room_name)
+
+    # Sprawdź, czy użytkownik jest właścicielem tablicy lub należy do grupy, która zawiera tę tablicę
+    if not (check_is_owner(room_obj, request.user) or user_in_board_group(room_obj, request.user)):
+        messages.add_message(request, 30, _("Nie masz uprawnień do tej tablicy!"), 'danger')
+        return redirect('my')
+    return None
 
 def group_and_login_required(view_func):
     """
@@ -132,44 +150,38 @@ def group_and_login_required(view_func):
 
     @wraps(view_func)
     async def _wrapped_view(request, room_name, *args, **kwargs):
-        # Sprawdź, czy użytkownik jest zalogowany
-        if not await sync_to_async(lambda: request.user.is_authenticated)():
-            messages.add_message(request, 30, _("Użytkownik musi być zalogowany!"), 'danger')
-            return redirect('custom_login')
+        denied_response = await group_member_check(request, room_name)
+        if denied_response is not None:
+            return denied_response
+        return await view_func(request, room_name, *args, **kwargs)
 
-        # Pobierz obiekt tablicy – zakładamy, że async_get_object_or_404 jest dostępny
-        room_obj = await async_get_object_or_404(ExcalidrawRoom, room_name=room_name)
+    return _wrapped_view
 
-        # Sprawdź, czy użytkownik jest właścicielem tablicy
-        is_owner = await check_is_owner(room_obj, request.user)
-        # Sprawdź, czy użytkownik należy do grupy, która zawiera tę tablicę
-        is_in_group = await user_in_board_group(room_obj, request.user)
+@sync_to_async
+def owner_check(request, room_name):
+    """
+    Runs the checks of :func:`owner_required` in a single thread pool call.
 
-        if not (is_owner or is_in_group):
-            messages.add_message(request, 30, _("Nie masz uprawnień do tej tablicy!"), 'danger')
-            return redirect('my')
+    :returns: a response if the user may not access the room, otherwise ``None``.
+    """
+    # Sprawdzenie, czy użytkownik jest zalogowany
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden("Użytkownik musi być zalogowany.")
 
-        return await view_func(request, room_name, *args, **kwargs)
+    room_obj = get_object_or_404(ExcalidrawRoom.objects.only('room_created_by'), room_name=room_name)
 
-    return _wrapped_view
+    # Sprawdzenie, czy użytkownik jest właścicielem tablicy
+    if not check_is_owner(room_obj, request.user) and not request.user.is_staff:
+        messages.add_message(request, 30, _("Nie jesteś właścicielem tej tablicy!"), 'danger')
+        return redirect('shared_board_groups')
+    return None
 
 def owner_required(view_func):
     @wraps(view_func)
     async def _wrapped_view(request, room_name, *args, **kwargs):
-        # Sprawdzenie, czy użytkownik jest zalogowany
-        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
-        if not is_authenticated:
-            return HttpResponseForbidden("Użytkownik musi być zalogowany.")
-
-        # Pobranie obiektu tablicy asynchronicznie
-        room_obj = await async_get_object_or_404(ExcalidrawRoom, room_name=room_name)
-
-        # Sprawdzenie, czy użytkownik jest właścicielem tablicy
-        is_owner = await sync_to_async(lambda: room_obj.room_created_by == request.user)()
-        if not is_owner and not request.user.is_staff:
-            messages.add_message(request, 30, _("Nie jesteś właścicielem tej tablicy!"), 'danger')
-            return redirect('shared_board_groups')
-
+        denied_response = await owner_check(request, room_name)
+        if denied_response is not None:
+            return denied_response
         return await view_func(request, room_name, *args, **kwargs)
     return _wrapped_view
 
@@ -1,8 +1,9 @@
 import logging
 import traceback
-from typing import Optional, Set
+from typing import FrozenSet, Optional
 from urllib.parse import urlunsplit
 
+import orjson
 from channels.exceptions import StopConsumer
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.conf import settings
@@ -39,7 +40,16 @@ class LoggingAsyncJsonWebsocketConsumer(AsyncJsonWebsocketConsumer):
 
     You can configure the log by changing the logger config for `draw.websocket`
     """
-    allowed_eventtypes: Set[str] = set()
+    allowed_eventtypes: FrozenSet[str] = frozenset()
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return orjson.loads(text_data)
+
+    @classmethod
+    async def encode_json(cls, content):
+        # channels expects text frames, orjson produces utf-8 encoded bytes
+        return orjson.dumps(content).decode('utf-8')
 
     async def webscoket_receive(self, message):
         """